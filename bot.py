@@ -1,15 +1,15 @@
-import os, random, signal, datetime as dt, io
+import os, sys, random, signal, time, datetime as dt, io, asyncio, contextlib, hashlib
+from collections import defaultdict
 from pathlib import Path
+from types import MappingProxyType
+from typing import Final
 
 import aiosqlite
 import discord
 from discord import app_commands
 from discord.ext import commands
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-from apscheduler.triggers.interval import IntervalTrigger
 from zoneinfo import ZoneInfo
-from openai import OpenAI
+from openai import AsyncOpenAI
 
 # -------------------- env helpers --------------------
 def getenv_int(name: str, default: int) -> int:
@@ -38,12 +38,15 @@ if not TOKEN:
 
 DB_PATH = os.getenv("DB_PATH", "/data/madsminder.db")
 TZ = os.getenv("TZ", "America/New_York")
+TZINFO = ZoneInfo(TZ)
 ANNOUNCE_CHANNEL_ID = getenv_int("ANNOUNCE_CHANNEL_ID", 0)   # optional
 JOURNAL_CHANNEL_ID = getenv_int("JOURNAL_CHANNEL_ID", ANNOUNCE_CHANNEL_ID)  # text channel for public diary posts
 
 THREAT_GRACE_MINUTES      = getenv_int("THREAT_GRACE_MINUTES", 360)    # 6h before nudges
 THREAT_COOLDOWN_MINUTES   = getenv_int("THREAT_COOLDOWN_MINUTES", 180) # 3h between nudges
 MAX_THREATS_PER_TASK      = getenv_int("MAX_THREATS_PER_TASK", 5)
+SCAN_CONCURRENCY          = getenv_int("SCAN_CONCURRENCY", 8)  # parallel Discord calls per scan
+DAILY_MISFIRE_GRACE_MINUTES = getenv_int("DAILY_MISFIRE_GRACE_MINUTES", 60)  # late start still runs a daily job
 GUILD_ID                  = getenv_int_or_none("GUILD_ID")
 
 CELEBRATE_DIR             = os.getenv("CELEBRATE_DIR", "/app/celebrate_images")
@@ -53,7 +56,8 @@ PEPTALKS_DIR              = os.getenv("PEPTALKS_DIR", "/app/peptalks")  # .mp3 p
 STREAK_VIDEOS_DIR         = os.getenv("STREAK_VIDEOS_DIR", "/app/streak_videos")  # .mp4/.mov/.webm
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai_client = OpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None
+openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY) if OPENAI_API_KEY else None  # one client, one HTTP pool
+OPENAI_CONCURRENCY = getenv_int("OPENAI_CONCURRENCY", 4)  # model calls in flight at once
 
 print(
     f"[startup] TZ={TZ} ANNOUNCE_CHANNEL_ID={ANNOUNCE_CHANNEL_ID} JOURNAL_CHANNEL_ID={JOURNAL_CHANNEL_ID} "
@@ -68,14 +72,37 @@ INTENTS = discord.Intents.default()
 INTENTS.reactions = True
 bot = commands.Bot(command_prefix="!", intents=INTENTS)
 
-def _handle_signal(sig, frame):
-    print(f"[signal] received {sig}, shutting down gracefully")
-signal.signal(signal.SIGTERM, _handle_signal)
-signal.signal(signal.SIGINT, _handle_signal)
+# Channels and users rarely change, so keep the ones we had to fetch over REST
+# instead of paying a round-trip every time they miss discord.py's cache.
+LOOKUP_TTL_SECONDS = 900
+_channel_cache: dict[int, tuple[float, object]] = {}
+_user_cache: dict[int, tuple[float, discord.User]] = {}
+
+async def resolve_channel(channel_id: int):
+    channel = bot.get_channel(channel_id)
+    if channel is not None:
+        return channel
+    hit = _channel_cache.get(channel_id)
+    if hit and time.monotonic() - hit[0] < LOOKUP_TTL_SECONDS:
+        return hit[1]
+    channel = await bot.fetch_channel(channel_id)
+    _channel_cache[channel_id] = (time.monotonic(), channel)
+    return channel
+
+async def resolve_user(user_id: int) -> discord.User:
+    user = bot.get_user(user_id)
+    if user is not None:
+        return user
+    hit = _user_cache.get(user_id)
+    if hit and time.monotonic() - hit[0] < LOOKUP_TTL_SECONDS:
+        return hit[1]
+    user = await bot.fetch_user(user_id)
+    _user_cache[user_id] = (time.monotonic(), user)
+    return user
 
 # -------------------- phrases --------------------
 LINES = {
-    "task_tick": [
+    "task_tick": (
         "One down. Understated excellence.", "Neat work. Don’t let it go to your head.",
         "Progress suits you.", "A clean strike. The kind that scares paperwork.",
         "Good. Now keep moving.", "Tidy work. It almost looks easy.",
@@ -86,9 +113,9 @@ LINES = {
         "That’s how it’s done. Without fuss.", "Clean and quiet—just how I like it.",
         "Another mark in your favour.", "One more step in the right direction.",
         "Done without drama. Excellent.", "If only all victories were this tidy.",
-    ],
+    ),
     # ominous, non-violent
-    "threat": [
+    "threat": (
         "You’ve left something undone. It watches. I do as well.",
         "I could tidy this for you. My methods are… exacting.",
         "Every loose end wants trimming. I’m quite good with edges.",
@@ -109,9 +136,9 @@ LINES = {
         "One final bite, and the day is yours.",
         "You left the table before the last course. Rude.",
         "Do finish. It’s far more pleasant than being finished with.",
-    ],
+    ),
     # random celebratory line when posting the 6+ image
-    "celebrate": [
+    "celebrate": (
         "Order restored. Enjoy the spoils.", "Six clean cuts. I’m impressed—quietly.",
         "Discipline looks good on you.", "Efficiency is a refined taste. You have it.",
         "You carved today to your liking. Elegant.", "The day yielded. You insisted.",
@@ -122,9 +149,9 @@ LINES = {
         "Graceful, relentless, effective.", "No fuss. Just results.",
         "If only everyone were so… capable.", "You didn’t hesitate. Nor should you.",
         "A fine performance. Take your bow.", "Meticulous. I approve.",
-    ],
+    ),
     # streak sayings: when streak > 0
-    "streak_keep": [
+    "streak_keep": (
         "Routine is an art when practiced daily.",
         "Elegance is repetition without boredom.",
         "Discipline is appetite refined. Keep feeding it.",
@@ -145,9 +172,9 @@ LINES = {
         "Momentum is a delicate broth. Don’t spill it.",
         "You’ve acquired a taste for progress.",
         "Let’s keep things exquisitely predictable.",
-    ],
+    ),
     # streak sayings: when streak == 0 (reset)
-    "streak_reset": [
+    "streak_reset": (
         "A lapse. Untidy. Let’s not make a habit of it.",
         "You missed a step. I prefer symmetry.",
         "The pattern broke. Reassemble yourself.",
@@ -168,147 +195,457 @@ LINES = {
         "You can do better. In fact, you will.",
         "Let’s restore the formality of progress.",
         "Begin again—without apology, with intent.",
-    ],
+    ),
     # daily prompt lines for morning task nudge
-    "daily_prompt": [
+    "daily_prompt": (
         "Three neat strokes will carve the day to your liking.",
         "Choose three. Complete them. Enjoy the silence afterward.",
         "Precision first, ambition second. List three.",
         "Make a short list and a long stride.",
         "You know the drill. Tasteful efficiency only.",
-    ],
+    ),
+    # afternoon journal prompt lines
+    "journal_prompt": (
+        "Three minutes. One page. Make it count.",
+        "Write with restraint; reveal with honesty.",
+        "Record what mattered—not everything that happened.",
+        "A day unexamined repeats itself.",
+        "Clarity prefers ink.",
+        "Give your memory a witness.",
+        "Note one thing you’d repeat and one you wouldn’t.",
+        "You can’t improve what you won’t observe.",
+        "Civilise the day with language.",
+        "Say less, mean more.",
+    ),
 }
-def pick(seq): return random.choice(seq)
+LINES = MappingProxyType({k: tuple(sys.intern(line) for line in v) for k, v in LINES.items()})
+_rng = random.Random()
+pick = _rng.choice
+
+# Phrases are dealt from a shuffled bag per category: one shuffle per pass through
+# the lines, a list.pop() per message, and no line repeats until the rest are used.
+_line_bags: dict[str, list[str]] = {}
+
+def pick_line(key: str) -> str:
+    bag = _line_bags.get(key)
+    if not bag:
+        bag = _line_bags[key] = list(LINES[key])
+        _rng.shuffle(bag)
+    return bag.pop()
 
 # -------------------- file pickers --------------------
+# Directory listings keyed by path; a directory's mtime moves whenever a file is
+# added, removed or renamed in it, so one stat() tells us whether to re-scan.
+# The pickers still touch the filesystem, so handlers call them via asyncio.to_thread.
+_dir_cache: dict[tuple[Path, frozenset[str]], tuple[float, list[Path]]] = {}
+
 def _list_files(dirpath: Path, exts: set[str]) -> list[Path]:
-    if not dirpath.exists():
+    key = (dirpath, frozenset(exts))
+    try:
+        mtime = dirpath.stat().st_mtime
+    except OSError:
+        _dir_cache.pop(key, None)
         return []
+    hit = _dir_cache.get(key)
+    if hit and hit[0] == mtime:
+        return hit[1]
     out = []
     for p in dirpath.iterdir():
         if p.is_file() and p.suffix.lower() in exts:
             out.append(p)
+    _dir_cache[key] = (mtime, out)
     return out
 
+CELEBRATE_PATHS = (Path(CELEBRATE_DIR), Path("/app/celebrate_images"), Path("./celebrate_images"))
+PEPTALK_PATHS = (Path(PEPTALKS_DIR), Path("/app/peptalks"), Path("./peptalks"), Path("/peptalks"))
+STREAK_VIDEO_PATHS = (Path(STREAK_VIDEOS_DIR), Path("/app/streak_videos"), Path("./streak_videos"))
+
 def pick_celebration_image() -> Path | None:
     files = []
-    for loc in (Path(CELEBRATE_DIR), Path("/app/celebrate_images"), Path("./celebrate_images")):
+    for loc in CELEBRATE_PATHS:
         files.extend(_list_files(loc, {".png", ".jpg", ".jpeg", ".gif"}))
-    return random.choice(files) if files else None
+    return pick(files) if files else None
 
 def pick_peptalk_mp3() -> Path | None:
     files = []
-    for loc in (Path(PEPTALKS_DIR), Path("/app/peptalks"), Path("./peptalks"), Path("/peptalks")):
+    for loc in PEPTALK_PATHS:
         files.extend(_list_files(loc, {".mp3"}))
-    return random.choice(files) if files else None
+    return pick(files) if files else None
 
 def pick_streak_video() -> Path | None:
     files = []
-    for loc in (Path(STREAK_VIDEOS_DIR), Path("/app/streak_videos"), Path("./streak_videos")):
+    for loc in STREAK_VIDEO_PATHS:
         files.extend(_list_files(loc, {".mp4", ".mov", ".webm"}))
-    return random.choice(files) if files else None
+    return pick(files) if files else None
 
 # -------------------- db helpers --------------------
-async def get_db():
-    conn = await aiosqlite.connect(DB_PATH)
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS tasks(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            task_date TEXT,
-            task_text TEXT,
-            done INTEGER DEFAULT 0,
-            message_id TEXT,
-            channel_id TEXT,
-            created_at TEXT,
-            last_threat_at TEXT
-        )
-    """)
-    cols = {row[1] for row in await (await conn.execute("PRAGMA table_info(tasks)")).fetchall()}
-    if "due_type" not in cols:
-        await conn.execute("ALTER TABLE tasks ADD COLUMN due_type TEXT")
-    if "due_at" not in cols:
-        await conn.execute("ALTER TABLE tasks ADD COLUMN due_at TEXT")
-    if "threat_count" not in cols:
-        await conn.execute("ALTER TABLE tasks ADD COLUMN threat_count INTEGER DEFAULT 0")
-    if "closed" not in cols:
-        await conn.execute("ALTER TABLE tasks ADD COLUMN closed INTEGER DEFAULT 0")
-    if "completed_at" not in cols:
-        await conn.execute("ALTER TABLE tasks ADD COLUMN completed_at TEXT")
+# One long-lived writer connection plus a small pool of read-only connections,
+# all opened once in setup_hook. WAL lets the readers run alongside the writer.
+DB: aiosqlite.Connection | None = None
+# Every coroutine shares the writer connection, so an await in the middle of one
+# handler's transaction lets another handler's commit() land it half-done.
+# Hold DB_LOCK from the first write until the commit.
+DB_LOCK = asyncio.Lock()
+# message_ids of tasks that are not done yet. A ✅ on any other message can't
+# complete anything, so the reaction handler answers it without touching SQLite.
+# Only ever a superset: ids are added before their row commits and removed after.
+_open_task_messages: set[int] = set()
+DB_READERS = getenv_int("DB_READERS", 4)
+_readers: asyncio.Queue | None = None
+_reader_count = 0  # readers actually opened, which is what close_db has to wait for
+
+CONN_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA cache_size=-65536;
+    PRAGMA mmap_size=10737418240;
+    PRAGMA busy_timeout=3000;
+"""
+
+@contextlib.asynccontextmanager
+async def acquire_reader():
+    conn = await _readers.get()
+    try:
+        yield conn
+    finally:
+        _readers.put_nowait(conn)
+
+# Timestamps are stored as INTEGER unix seconds (UTC), Discord ids as INTEGER snowflakes.
+TASKS_DDL = """
+    CREATE TABLE IF NOT EXISTS tasks(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        task_date TEXT,
+        task_text TEXT,
+        done INTEGER DEFAULT 0,
+        message_id INTEGER,
+        channel_id INTEGER,
+        created_at INTEGER,
+        last_threat_at INTEGER,
+        due_type TEXT,
+        due_at INTEGER,
+        threat_count INTEGER DEFAULT 0,
+        closed INTEGER DEFAULT 0,
+        completed_at INTEGER
+    )
+"""
+TASKS_EPOCH_COLS = ("created_at", "last_threat_at", "due_at", "completed_at")
+TASKS_ID_COLS = ("user_id", "message_id", "channel_id")
+
+REMINDERS_DDL = """
+    CREATE TABLE IF NOT EXISTS reminders(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        channel_id INTEGER,
+        text TEXT,
+        remind_at INTEGER,
+        created_at INTEGER,
+        sent INTEGER DEFAULT 0
+    )
+"""
+REMINDERS_EPOCH_COLS = ("remind_at", "created_at")
+REMINDERS_ID_COLS = ("user_id", "channel_id")
+
+CELEBRATIONS_DDL = """
+    CREATE TABLE IF NOT EXISTS celebrations(
+        user_id INTEGER,
+        task_date TEXT,
+        sent INTEGER DEFAULT 0,
+        PRIMARY KEY(user_id, task_date)
+    )
+"""
+STREAK_AWARDS_DDL = """
+    CREATE TABLE IF NOT EXISTS streak_awards(
+        user_id INTEGER,
+        award_date TEXT,
+        streak_len INTEGER,
+        PRIMARY KEY(user_id, award_date)
+    )
+"""
+
+JOURNALS_DDL = """
+    CREATE TABLE IF NOT EXISTS journals(
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER,
+        content TEXT,
+        created_at INTEGER,
+        local_date TEXT,    -- YYYY-MM-DD in TZ
+        is_private INTEGER DEFAULT 0,
+        message_id INTEGER, -- if public, the board message id
+        channel_id INTEGER  -- if public, the board channel id (thread or channel)
+    )
+"""
+JOURNALS_EPOCH_COLS = ("created_at",)
+JOURNALS_ID_COLS = ("user_id", "message_id", "channel_id")
+
+# Full-text index over journals.content for /finddiary. External content: the text
+# lives only in journals, and the triggers keep the index in step with it.
+JOURNALS_FTS_DDL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS journals_fts USING fts5(content, content='journals', content_rowid='id', tokenize='unicode61')",
+    """CREATE TRIGGER IF NOT EXISTS journals_fts_ai AFTER INSERT ON journals BEGIN
+        INSERT INTO journals_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS journals_fts_ad AFTER DELETE ON journals BEGIN
+        INSERT INTO journals_fts(journals_fts, rowid, content) VALUES ('delete', old.id, old.content);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS journals_fts_au AFTER UPDATE OF content ON journals BEGIN
+        INSERT INTO journals_fts(journals_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        INSERT INTO journals_fts(rowid, content) VALUES (new.id, new.content);
+    END""",
+)
+
+# Hot-path statements. sqlite3 keeps a per-connection cache of prepared
+# statements keyed by SQL text, so keeping one canonical string per query
+# (and a cache big enough for all of them) means each is prepared once.
+DB_STATEMENT_CACHE = 256
+
+SQL_INSERT_TASK: Final = """
+    INSERT INTO tasks(user_id, task_date, task_text, message_id, channel_id, created_at, due_type, due_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    RETURNING id
+"""
+SQL_INSERT_REMINDER: Final = """
+    INSERT INTO reminders(user_id, channel_id, text, remind_at, created_at, sent)
+    VALUES (?, ?, ?, ?, ?, 0)
+"""
+SQL_INSERT_JOURNAL: Final = """
+    INSERT INTO journals(user_id, content, created_at, local_date, is_private, message_id, channel_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+"""
+# The unary + keeps the planner on idx_tasks_message (one row) rather than
+# idx_tasks_user_done_completed (every open task the user has).
+SQL_MARK_DONE: Final = "UPDATE tasks SET done=1, completed_at=? WHERE message_id=? AND +user_id=? AND +done=0 RETURNING id"
+# Claims the day's celebration once :uid has :threshold completions with
+# completed_at in [:start, :end) of the local day (see local_day_bounds()). Returns
+# a row only for the call that flips it on; counting and claiming is one statement.
+SQL_CLAIM_CELEBRATION: Final = """
+    INSERT INTO celebrations(user_id, task_date, sent)
+    SELECT :uid, :day, 1
+    WHERE (SELECT COUNT(*) FROM tasks
+           WHERE user_id=:uid AND done=1 AND completed_at >= :start AND completed_at < :end) >= :threshold
+    ON CONFLICT(user_id, task_date) DO UPDATE SET sent=1 WHERE sent=0
+    RETURNING 1
+"""
+SQL_ANY_OPEN_TASK: Final = "SELECT 1 FROM tasks WHERE done=0 AND closed=0 LIMIT 1"
+SQL_THREAT_CANDIDATES: Final = """
+    SELECT id, user_id, message_id, channel_id
+    FROM tasks
+    WHERE done=0 AND closed=0 AND COALESCE(threat_count,0) < ?
+      AND CASE WHEN due_at IS NOT NULL THEN due_at <= ? ELSE created_at <= ? END
+      AND (last_threat_at IS NULL OR last_threat_at <= ?)
+"""
+# Earliest moment any live task becomes eligible under SQL_THREAT_CANDIDATES:
+# its readiness time, pushed back by the cooldown after the last nudge.
+SQL_NEXT_THREAT_DUE: Final = """
+    SELECT MIN(MAX(CASE WHEN due_at IS NOT NULL THEN due_at ELSE created_at + ? END,
+                   COALESCE(last_threat_at + ?, 0)))
+    FROM tasks
+    WHERE done=0 AND closed=0 AND COALESCE(threat_count,0) < ?
+"""
+SQL_THREAT_SENT: Final = "UPDATE tasks SET last_threat_at=?, threat_count=COALESCE(threat_count,0)+1 WHERE id=?"
+SQL_THREAT_CLOSE: Final = "UPDATE tasks SET closed=1, last_threat_at=? WHERE id=?"
+
+# How _migrate_to_integer converts a TEXT column: ISO-8601 timestamps to epoch
+# seconds, Discord ids (snowflakes, always < 2**63) to plain integers.
+EPOCH_CAST = "CAST(strftime('%s', {}) AS INTEGER)"
+ID_CAST = "CAST({} AS INTEGER)"
+
+async def _migrate_to_integer(conn, table: str, ddl: str, casts: dict[str, str]):
+    """
+    Older databases stored timestamps as ISO-8601 TEXT and Discord ids as TEXT. A TEXT
+    column would coerce integers back to strings, so rebuild the table with INTEGER
+    columns and convert each one still declared otherwise with its casts expression.
+    """
+    info = await conn.execute_fetchall(f"PRAGMA table_info({table})")
+    types = {row[1]: (row[2] or "").upper() for row in info}
+    casts = {c: cast for c, cast in casts.items() if c in types and types[c] != "INTEGER"}
+    if not casts:
+        return
+    cols = [row[1] for row in info]
+    select = ", ".join(casts[c].format(c) if c in casts else c for c in cols)
+    await conn.execute("BEGIN")
+    await conn.execute(f"ALTER TABLE {table} RENAME TO {table}_text")
+    await conn.execute(ddl)
+    await conn.execute(f"INSERT INTO {table}({', '.join(cols)}) SELECT {select} FROM {table}_text")
+    await conn.execute(f"DROP TABLE {table}_text")
     await conn.commit()
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS reminders(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            channel_id TEXT,
-            text TEXT,
-            remind_at TEXT,
-            created_at TEXT,
-            sent INTEGER DEFAULT 0
-        )
-    """)
+    print(f"[db] converted {table}.{', '.join(casts)} to INTEGER")
+
+def _integer_casts(epoch_cols: tuple[str, ...], id_cols: tuple[str, ...]) -> dict[str, str]:
+    return {**dict.fromkeys(epoch_cols, EPOCH_CAST), **dict.fromkeys(id_cols, ID_CAST)}
+
+# Per-scope statements for /mytasks and /cleartasks; all bind the same {uid, day, cap} mapping.
+# /mytasks fetches at most :cap rows (more than one message can show) plus the scope's
+# total, counted once off the index, for the "… and N more" line.
+MYTASKS_ROW_CAP = 300
+MYTASKS_SQL: Final = MappingProxyType({
+    "today": "SELECT task_text, done, task_date, (SELECT COUNT(*) FROM tasks WHERE user_id=:uid AND task_date=:day) "
+             "FROM tasks WHERE user_id=:uid AND task_date=:day ORDER BY id ASC LIMIT :cap",
+    "open": "SELECT task_text, done, task_date, (SELECT COUNT(*) FROM tasks WHERE user_id=:uid AND done=0) "
+            "FROM tasks WHERE user_id=:uid AND done=0 ORDER BY created_at ASC LIMIT :cap",
+    "all": "SELECT task_text, done, task_date, (SELECT COUNT(*) FROM tasks WHERE user_id=:uid) "
+           "FROM tasks WHERE user_id=:uid ORDER BY created_at DESC LIMIT :cap",
+})
+CLEAR_TASKS_SQL: Final = MappingProxyType({
+    "today": "DELETE FROM tasks WHERE user_id=:uid AND task_date=:day RETURNING message_id",
+    "open": "DELETE FROM tasks WHERE user_id=:uid AND done=0 RETURNING message_id",
+    "all": "DELETE FROM tasks WHERE user_id=:uid RETURNING message_id",
+})
+CLEAR_CELEBRATIONS_SQL: Final = MappingProxyType({
+    "today": "DELETE FROM celebrations WHERE user_id=:uid AND task_date=:day",
+    "open": None,
+    "all": "DELETE FROM celebrations WHERE user_id=:uid",
+})
+
+# PRAGMA user_version records which migration steps in init_db a file has been
+# through: 1 = tasks has the due/threat/completed columns, 2 = epoch timestamps,
+# 3 = epoch journal timestamps, 4 = journals_fts built, 5 = INTEGER Discord ids.
+SCHEMA_VERSION = 5
+
+async def init_db():
+    global DB, _readers, _reader_count
+    conn = await aiosqlite.connect(DB_PATH, cached_statements=DB_STATEMENT_CACHE)
+    await conn.executescript("PRAGMA journal_mode=WAL; PRAGMA wal_autocheckpoint=1000;" + CONN_PRAGMAS)
+    (version,) = await fetch_one(conn, "PRAGMA user_version")
+    await conn.execute(TASKS_DDL)
+    if version < 1:
+        cols = {row[1] for row in await conn.execute_fetchall("PRAGMA table_info(tasks)")}
+        if "due_type" not in cols:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN due_type TEXT")
+        if "due_at" not in cols:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN due_at TEXT")
+        if "threat_count" not in cols:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN threat_count INTEGER DEFAULT 0")
+        if "closed" not in cols:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN closed INTEGER DEFAULT 0")
+        if "completed_at" not in cols:
+            await conn.execute("ALTER TABLE tasks ADD COLUMN completed_at TEXT")
+        await conn.commit()
+    if version < 5:
+        await _migrate_to_integer(conn, "tasks", TASKS_DDL, _integer_casts(TASKS_EPOCH_COLS, TASKS_ID_COLS))
+    # scans only ever look at live tasks; keep finished/closed history out of their index
+    await conn.execute("DROP INDEX IF EXISTS idx_tasks_scan")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_open ON tasks(created_at, last_threat_at) WHERE done=0 AND closed=0")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_message ON tasks(message_id)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_date ON tasks(user_id, task_date)")
+    # (user_id, done) serves the open scopes; completed_at adds per-day completion ranges
+    await conn.execute("DROP INDEX IF EXISTS idx_tasks_user_done")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_done_completed ON tasks(user_id, done, completed_at)")
+    # /mytasks open and all scopes read a user's tasks in created_at order straight off these.
+    # Not partial on done=0: the scans would take that over idx_tasks_open and read closed rows.
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_done_created ON tasks(user_id, done, created_at)")
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks(user_id, created_at)")
     await conn.commit()
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS celebrations(
-            user_id TEXT,
-            task_date TEXT,
-            sent INTEGER DEFAULT 0,
-            PRIMARY KEY(user_id, task_date)
-        )
-    """)
+    await conn.execute(REMINDERS_DDL)
+    if version < 5:
+        await _migrate_to_integer(conn, "reminders", REMINDERS_DDL, _integer_casts(REMINDERS_EPOCH_COLS, REMINDERS_ID_COLS))
+    await conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_pending ON reminders(remind_at) WHERE sent=0")
     await conn.commit()
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS streak_awards(
-            user_id TEXT,
-            award_date TEXT,
-            streak_len INTEGER,
-            PRIMARY KEY(user_id, award_date)
-        )
-    """)
+    await conn.execute(CELEBRATIONS_DDL)
+    await conn.execute(STREAK_AWARDS_DDL)
+    if version < 5:
+        await _migrate_to_integer(conn, "celebrations", CELEBRATIONS_DDL, _integer_casts((), ("user_id",)))
+        await _migrate_to_integer(conn, "streak_awards", STREAK_AWARDS_DDL, _integer_casts((), ("user_id",)))
     await conn.commit()
     # --------- Journals ----------
-    await conn.execute("""
-        CREATE TABLE IF NOT EXISTS journals(
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id TEXT,
-            content TEXT,
-            created_at TEXT,    -- UTC ISO timestamp
-            local_date TEXT,    -- YYYY-MM-DD in TZ
-            is_private INTEGER DEFAULT 0,
-            message_id TEXT,    -- if public, the board message id
-            channel_id TEXT     -- if public, the board channel id (thread or channel)
-        )
-    """)
-    await conn.commit()
+    await conn.execute(JOURNALS_DDL)
+    if version < 5:
+        # runs before the FTS triggers are (re)created; the rebuild drops them with the old table
+        await _migrate_to_integer(conn, "journals", JOURNALS_DDL, _integer_casts(JOURNALS_EPOCH_COLS, JOURNALS_ID_COLS))
     await conn.execute("CREATE INDEX IF NOT EXISTS idx_journals_user_created ON journals(user_id, created_at)")
     await conn.execute("CREATE INDEX IF NOT EXISTS idx_journals_user_date ON journals(user_id, local_date)")
+    for stmt in JOURNALS_FTS_DDL:
+        await conn.execute(stmt)
+    if version < 4:
+        await conn.execute("INSERT INTO journals_fts(journals_fts) VALUES('rebuild')")
+    # last run of each daily job, so a restart can tell whether it missed one
+    await conn.execute("CREATE TABLE IF NOT EXISTS job_runs(name TEXT PRIMARY KEY, last_run INTEGER)")
+    if version < SCHEMA_VERSION:
+        await conn.execute(f"PRAGMA user_version={SCHEMA_VERSION}")
     await conn.commit()
-    return conn
+    DB = conn
+    _open_task_messages.update(r[0] for r in await conn.execute_fetchall("SELECT message_id FROM tasks WHERE done=0"))
+
+    _readers = asyncio.Queue()
+    for _ in range(max(1, DB_READERS)):
+        reader = await aiosqlite.connect(f"file:{DB_PATH}?mode=ro", uri=True, cached_statements=DB_STATEMENT_CACHE)
+        # pooled before its pragmas run, so close_db still closes it if they fail
+        _readers.put_nowait(reader)
+        _reader_count += 1
+        await reader.executescript("PRAGMA query_only=1;" + CONN_PRAGMAS)
+
+async def close_db():
+    """Close the writer once no write is in flight, then every pooled reader."""
+    global DB, _readers, _reader_count
+    if DB is None:
+        return
+    async with DB_LOCK:
+        await DB.execute("PRAGMA optimize")
+        await DB.close()
+        DB = None
+    # only as many as init_db opened, or a partial start would hang here forever
+    for _ in range(_reader_count):
+        reader = await _readers.get()  # waits for readers still checked out
+        await reader.close()
+    _readers, _reader_count = None, 0
+
+async def fetch_one(conn, sql: str, params=()):
+    """First row of a query (or None) in a single hop to the connection's thread."""
+    rows = await conn.execute_fetchall(sql, params)
+    return rows[0] if rows else None
+
+async def insert_task(user_id: int, text: str, task_msg: discord.Message,
+                      due_type: str | None = None, due_at: dt.datetime | None = None) -> int:
+    """Record a task posted as task_msg; returns the new task id."""
+    _open_task_messages.add(task_msg.id)
+    async with DB_LOCK:
+        (task_id,) = await fetch_one(DB, SQL_INSERT_TASK, (
+            user_id, today_iso(), text, task_msg.id, task_msg.channel.id,
+            epoch(now_utc()), due_type, epoch(due_at) if due_at else None
+        ))
+        await DB.commit()
+    _threat_wakeup.set()
+    return task_id
 
 def now_utc() -> dt.datetime:
     return dt.datetime.now(dt.timezone.utc)
 
-def parse_iso(s: str | None):
-    if not s: return None
-    try:
-        return dt.datetime.fromisoformat(s)
-    except Exception:
-        return None
+def epoch(when: dt.datetime) -> int:
+    return int(when.timestamp())
+
+_today_cache = ("", 0.0)  # (YYYY-MM-DD, epoch of the next local midnight)
 
 def today_iso() -> str:
-    return dt.date.today().isoformat()
+    global _today_cache
+    iso, valid_until = _today_cache
+    if time.time() >= valid_until:
+        today = dt.date.today()
+        next_midnight = dt.datetime.combine(today + dt.timedelta(days=1), dt.time())
+        _today_cache = iso, valid_until = today.isoformat(), next_midnight.timestamp()
+    return iso
+
+def local_day_bounds(day: dt.date) -> tuple[int, int]:
+    """Epoch seconds of local midnight on day and on the day after, in TZ."""
+    start = dt.datetime.combine(day, dt.time(), TZINFO)
+    end = dt.datetime.combine(day + dt.timedelta(days=1), dt.time(), TZINFO)
+    return epoch(start), epoch(end)
 
 def to_utc(dt_local: dt.datetime) -> dt.datetime:
     return dt_local.astimezone(dt.timezone.utc)
 
-def end_of_day_utc(date_obj: dt.date, tz_str: str) -> dt.datetime:
-    tz = ZoneInfo(tz_str)
-    local_eod = dt.datetime(date_obj.year, date_obj.month, date_obj.day, 23, 59, 59, tzinfo=tz)
+def end_of_day_utc(date_obj: dt.date) -> dt.datetime:
+    local_eod = dt.datetime(date_obj.year, date_obj.month, date_obj.day, 23, 59, 59, tzinfo=TZINFO)
     return to_utc(local_eod)
 
 # -------------------- command registration --------------------
 @bot.event
 async def setup_hook():
+    await init_db()
+    start_jobs()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        with contextlib.suppress(NotImplementedError):  # not available on Windows
+            loop.add_signal_handler(sig, lambda sig=sig: asyncio.create_task(shutdown(sig)))
     try:
         if GUILD_ID:
             guild_obj = discord.Object(id=GUILD_ID)
@@ -327,18 +664,146 @@ async def setup_hook():
 @bot.event
 async def on_ready():
     print(f"Logged in as {bot.user}")
-    tz = ZoneInfo(TZ)
-    scheduler = AsyncIOScheduler()
+
+SHUTDOWN_GRACE_SECONDS = 20
+
+async def shutdown(sig: signal.Signals):
+    """
+    Stop the job loops, let a run already in progress finish its writes (a scan
+    that has sent its messages still has to mark them sent), then disconnect.
+    main() closes the database once bot.start() returns.
+    """
+    print(f"[signal] received {sig.name}, shutting down gracefully")
+    for task in _job_tasks:
+        task.cancel()
+    if _job_runs:
+        _, pending = await asyncio.wait(_job_runs, timeout=SHUTDOWN_GRACE_SECONDS)
+        for run in pending:
+            run.cancel()
+    await bot.close()
+
+# -------------------- scheduling --------------------
+# Plain asyncio loops started once from setup_hook (on_ready can fire again on
+# reconnect). Each loop awaits its job before sleeping again, so runs never overlap
+# and a slow scan simply delays the next one instead of stacking up behind it.
+_job_tasks: list[asyncio.Task] = []
+# Runs in flight. Shielded from their loop's cancellation so shutdown() can wait them out.
+_job_runs: set[asyncio.Task] = set()
+
+async def _run_job(job) -> bool:
+    """Run job to completion, shielded from cancellation; False if it raised."""
+    run = asyncio.ensure_future(job())
+    _job_runs.add(run)
+    run.add_done_callback(_job_runs.discard)
+    try:
+        await asyncio.shield(run)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        import traceback
+        print(f"[jobs] {job.__name__} failed:", repr(e))
+        traceback.print_exc()
+        return False
+    return True
+
+def seconds_until(hour: int, minute: int) -> float:
+    """Seconds until the next hour:minute wall-clock time in TZ."""
+    now = dt.datetime.now(TZINFO)
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target <= now:
+        target += dt.timedelta(days=1)
+    return target.timestamp() - now.timestamp()
+
+def last_occurrence(hour: int, minute: int) -> dt.datetime:
+    """The most recent hour:minute wall-clock time in TZ at or before now."""
+    now = dt.datetime.now(TZINFO)
+    target = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if target > now:
+        target -= dt.timedelta(days=1)
+    return target
+
+async def last_job_run(name: str) -> int:
+    row = await fetch_one(DB, "SELECT last_run FROM job_runs WHERE name=?", (name,))
+    return row[0] if row else 0
+
+async def record_job_run(name: str):
+    async with DB_LOCK:
+        await DB.execute(
+            "INSERT INTO job_runs(name, last_run) VALUES(?, ?) ON CONFLICT(name) DO UPDATE SET last_run=excluded.last_run",
+            (name, epoch(now_utc()))
+        )
+        await DB.commit()
+
+async def run_daily(hour: int, minute: int, job):
+    async def recorded():
+        # recorded inside the shielded run, failed or not, so a shutdown mid-job
+        # still records it and a quick restart doesn't send it twice
+        try:
+            await job()
+        finally:
+            await record_job_run(job.__name__)
+    recorded.__name__ = job.__name__
+    await bot.wait_until_ready()
+    # A restart shortly after the scheduled time (e.g. 09:15 for a 09:00 job) still
+    # runs the job once, unless it already ran before the restart.
+    missed = epoch(last_occurrence(hour, minute))
+    if epoch(now_utc()) - missed <= DAILY_MISFIRE_GRACE_MINUTES * 60 and await last_job_run(job.__name__) < missed:
+        print(f"[jobs] {job.__name__} missed at {hour:02d}:{minute:02d}, running now")
+        await _run_job(recorded)
+    while True:
+        await asyncio.sleep(seconds_until(hour, minute))
+        await _run_job(recorded)
+        await asyncio.sleep(1)  # step past the boundary so the next wait targets tomorrow
+
+# Set when a new row might be due sooner than the loop's current sleep.
+_reminder_wakeup = asyncio.Event()
+_threat_wakeup = asyncio.Event()
+MAX_JOB_SLEEP = 3600  # re-check hourly anyway, in case the wall clock jumps
+# Floor on the sleep after a failed pass, or when work is still overdue after one. A pass
+# that sent its messages but could not mark them sent would otherwise re-send them at once.
+JOB_RETRY_SECONDS = 60
+
+async def run_when_due(job, next_due_sql: str, params, wakeup: asyncio.Event):
+    """
+    Run job, then sleep until next_due_sql (a single MIN(...) epoch, NULL when
+    nothing is pending) says there is work again, or until wakeup is set.
+    """
+    await bot.wait_until_ready()
+    while True:
+        wakeup.clear()  # before the run, so a row added during it still wakes us
+        ok = await _run_job(job)
+        try:
+            async with acquire_reader() as conn:
+                (next_at,) = await fetch_one(conn, next_due_sql, params)
+        except Exception as e:
+            print(f"[jobs] {job.__name__} next-due check failed:", repr(e))
+            next_at, ok = None, False
+        if next_at is None:
+            delay = JOB_RETRY_SECONDS if not ok else MAX_JOB_SLEEP
+        else:
+            delay = next_at - time.time()
+            delay = JOB_RETRY_SECONDS if not ok or delay <= 0 else min(delay, MAX_JOB_SLEEP)
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(wakeup.wait(), delay)
+
+def start_jobs():
     if ANNOUNCE_CHANNEL_ID:
-        scheduler.add_job(daily_prompt, CronTrigger(hour=9, minute=0, timezone=tz))
-    scheduler.add_job(threat_scan,   IntervalTrigger(minutes=10, timezone=tz))
-    scheduler.add_job(reminder_scan, IntervalTrigger(minutes=1,  timezone=tz))
+        _job_tasks.append(asyncio.create_task(run_daily(9, 0, daily_prompt)))
+    # nudges and reminders wake when the next one is due rather than polling; a pass whose
+    # SQL_THREAT_SENT/SQL_THREAT_CLOSE batch fails leaves its tasks due, so run_when_due
+    # waits JOB_RETRY_SECONDS before nudging them again
+    _job_tasks.append(asyncio.create_task(run_when_due(
+        threat_scan, SQL_NEXT_THREAT_DUE,
+        (THREAT_GRACE_MINUTES * 60, THREAT_COOLDOWN_MINUTES * 60, MAX_THREATS_PER_TASK), _threat_wakeup
+    )))
+    _job_tasks.append(asyncio.create_task(run_when_due(
+        reminder_scan, "SELECT MIN(remind_at) FROM reminders WHERE sent=0", (), _reminder_wakeup
+    )))
     # streak digest at 3:00 AM local time
-    scheduler.add_job(streak_digest_all, CronTrigger(hour=3, minute=0, timezone=tz))
+    _job_tasks.append(asyncio.create_task(run_daily(3, 0, streak_digest_all)))
     # journal prompt at 3:00 PM local time
     if JOURNAL_CHANNEL_ID:
-        scheduler.add_job(journal_daily_prompt, CronTrigger(hour=15, minute=0, timezone=tz))
-    scheduler.start()
+        _job_tasks.append(asyncio.create_task(run_daily(15, 0, journal_daily_prompt)))
 
 # -------------------- Journal UI --------------------
 class JournalModal(discord.ui.Modal, title="Today’s Journal"):
@@ -356,46 +821,51 @@ class JournalModal(discord.ui.Modal, title="Today’s Journal"):
         # Prefer the configured board text channel; fall back to invoking location
         self._target_channel_id = target_channel_id  # fallback only
 
-    async def on_submit(self, interaction: discord.Interaction):
-        conn = await get_db()
-        now = now_utc()
-        local_day = dt.datetime.now(ZoneInfo(TZ)).date().isoformat()
-
-        post_id, post_channel = None, None
-        if not self._is_private:
-            dest = None
+    async def _post_public(self, interaction: discord.Interaction, local_day: str) -> tuple[int | None, int | None]:
+        """Post a public entry to the board; returns (message_id, channel_id) of the post, if any."""
+        if self._is_private:
+            return None, None
+        dest = None
+        try:
+            # 1) Always try the configured board (text) channel
+            if JOURNAL_CHANNEL_ID:
+                dest = await resolve_channel(JOURNAL_CHANNEL_ID)
+            # 2) Fallback to where the command/button was used
+            if dest is None and self._target_channel_id:
+                dest = await resolve_channel(self._target_channel_id)
+
+            if isinstance(dest, (discord.TextChannel, discord.Thread, discord.VoiceChannel, discord.StageChannel)):
+                msg = await dest.send(f"**Journal — {interaction.user.display_name} — {local_day}**\n{self.entry.value}")
+                return msg.id, dest.id
+            # Last resort: DM the user so they still see confirmation
             try:
-                # 1) Always try the configured board (text) channel
-                if JOURNAL_CHANNEL_ID:
-                    dest = interaction.client.get_channel(JOURNAL_CHANNEL_ID) or await interaction.client.fetch_channel(JOURNAL_CHANNEL_ID)
-                # 2) Fallback to where the command/button was used
-                if dest is None and self._target_channel_id:
-                    dest = interaction.client.get_channel(self._target_channel_id) or await interaction.client.fetch_channel(self._target_channel_id)
-
-                if isinstance(dest, (discord.TextChannel, discord.Thread, discord.VoiceChannel, discord.StageChannel)):
-                    msg = await dest.send(f"**Journal — {interaction.user.display_name} — {local_day}**\n{self.entry.value}")
-                    post_id, post_channel = str(msg.id), str(dest.id)
-                else:
-                    # Last resort: DM the user so they still see confirmation
-                    try:
-                        dm = await interaction.user.create_dm()
-                        await dm.send(f"(Journaling destination unavailable.)\n**Journal — {local_day}**\n{self.entry.value}")
-                    except Exception:
-                        pass
+                dm = await interaction.user.create_dm()
+                await dm.send(f"(Journaling destination unavailable.)\n**Journal — {local_day}**\n{self.entry.value}")
             except Exception:
-                # Still save; just no public post
                 pass
+        except Exception:
+            # Still save; just no public post
+            pass
+        return None, None
 
-        await conn.execute("""
-            INSERT INTO journals(user_id, content, created_at, local_date, is_private, message_id, channel_id)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-        """, (
-            str(self._user_id), self.entry.value, now.isoformat(), local_day,
-            1 if self._is_private else 0, post_id, post_channel
-        ))
-        await conn.commit(); await conn.close()
+    async def on_submit(self, interaction: discord.Interaction):
+        now = now_utc()
+        local_day = dt.datetime.now(TZINFO).date().isoformat()
 
-        await interaction.response.send_message("Saved.", ephemeral=True)
+        # acknowledge within the interaction window while the board post goes out
+        _, (post_id, post_channel) = await asyncio.gather(
+            interaction.response.defer(ephemeral=True, thinking=True),
+            self._post_public(interaction, local_day),
+        )
+
+        async with DB_LOCK:
+            await DB.execute(SQL_INSERT_JOURNAL, (
+                self._user_id, self.entry.value, epoch(now), local_day,
+                1 if self._is_private else 0, post_id, post_channel
+            ))
+            await DB.commit()
+
+        await interaction.followup.send("Saved.", ephemeral=True)
 
 class JournalPromptView(discord.ui.View):
     """
@@ -417,24 +887,25 @@ class JournalPromptView(discord.ui.View):
         await interaction.response.send_modal(modal)
 
 # -------------------- slash commands --------------------
+HELP_TEXT: Final = (
+    "**MadsMinder — Commands**\n"
+    "• `/addtask text:<task>`\n"
+    "• `/taskby days:<N> text:<task>`\n"
+    "• `/taskon date:<YYYY-MM-DD> text:<task>`\n"
+    "• `/remindme hours:<N> text:<note>`\n"
+    "• `/mytasks scope:(today|open|all)`\n"
+    "• `/cleartasks scope:(today|open|all)`\n"
+    "• `/peptalk` (random MP3 pep talk)\n"
+    "• `/writediary privacy:(public|private)`\n"
+    "• `/readdiary scope:(last5|last30|all)`\n"
+    "• `/finddiary query:<text> [limit]`\n"
+    "• `/exportdiary scope:(last30|all)`\n"
+    "\n3:00 AM: streak status • 3:00 PM: journal prompt."
+)
+
 @bot.tree.command(name="help", description="Show MadsMinder commands")
 async def help_cmd(interaction: discord.Interaction):
-    text = (
-        "**MadsMinder — Commands**\n"
-        "• `/addtask text:<task>`\n"
-        "• `/taskby days:<N> text:<task>`\n"
-        "• `/taskon date:<YYYY-MM-DD> text:<task>`\n"
-        "• `/remindme hours:<N> text:<note>`\n"
-        "• `/mytasks scope:(today|open|all)`\n"
-        "• `/cleartasks scope:(today|open|all)`\n"
-        "• `/peptalk` (random MP3 pep talk)\n"
-        "• `/writediary privacy:(public|private)`\n"
-        "• `/readdiary scope:(last5|last30|all)`\n"
-        "• `/finddiary query:<text> [limit]`\n"
-        "• `/exportdiary scope:(last30|all)`\n"
-        "\n3:00 AM: streak status • 3:00 PM: journal prompt."
-    )
-    await interaction.response.send_message(text, ephemeral=True)
+    await interaction.response.send_message(HELP_TEXT, ephemeral=True)
 
 @bot.tree.command(name="writediary", description="Open the journal entry modal")
 @app_commands.describe(privacy="Choose whether to post publicly to the board or keep it private")
@@ -451,6 +922,13 @@ async def writediary(interaction: discord.Interaction, privacy: app_commands.Cho
         JournalModal(user_id=interaction.user.id, is_private=is_private, target_channel_id=target_channel_id)
     )
 
+# Each row comes back as its finished display block; LIMIT -1 means no limit.
+SQL_READ_DIARY: Final = """
+    SELECT printf('**%s**%s' || char(10) || '%s' || char(10), local_date, CASE WHEN is_private THEN ' 🔒' ELSE '' END, content)
+    FROM journals WHERE user_id=? ORDER BY created_at DESC LIMIT ?
+"""
+READ_DIARY_LIMITS: Final = MappingProxyType({"last5": 5, "last30": 30, "all": -1})
+
 @bot.tree.command(name="readdiary", description="Read your journal entries")
 @app_commands.describe(scope="How many to show: last5, last30, or all")
 @app_commands.choices(
@@ -462,33 +940,16 @@ async def writediary(interaction: discord.Interaction, privacy: app_commands.Cho
 )
 async def readdiary(interaction: discord.Interaction, scope: app_commands.Choice[str] = None):
     scope_val = (scope.value if scope else "last5").lower()
-    uid = str(interaction.user.id)
-    conn = await get_db()
-
-    base_sql = "SELECT local_date, content, is_private FROM journals WHERE user_id=? ORDER BY datetime(created_at) DESC"
-    if scope_val == "last5":
-        sql = base_sql + " LIMIT 5"
-    elif scope_val == "last30":
-        sql = base_sql + " LIMIT 30"
-    else:
-        sql = base_sql
-    cur = await conn.execute(sql, (uid,))
-    rows = await cur.fetchall(); await cur.close(); await conn.close()
+    uid = interaction.user.id
+
+    async with acquire_reader() as conn:
+        rows = await conn.execute_fetchall(SQL_READ_DIARY, (uid, READ_DIARY_LIMITS.get(scope_val, -1)))
 
     if not rows:
         await interaction.response.send_message("No entries found.", ephemeral=True); return
 
-    def fmt(d, c, priv):
-        lock = " 🔒" if priv else ""
-        return f"**{d}**{lock}\n{c}\n"
-
-    chunks, buf = [], ""
-    for (d, c, priv) in rows:
-        block = fmt(d, c, priv) + "\n"
-        if len(buf) + len(block) > 1900:
-            chunks.append(buf); buf = ""
-        buf += block
-    if buf: chunks.append(buf)
+    # entries separated by a blank line; chunk_lines builds each message with one join
+    chunks = chunk_lines([block for (block,) in rows])
 
     await interaction.response.send_message(chunks[0], ephemeral=True)
     for extra in chunks[1:]:
@@ -501,37 +962,34 @@ async def finddiary(interaction: discord.Interaction, query: str, limit: int = 1
     if not q:
         await interaction.response.send_message("Give me something to search for.", ephemeral=True); return
     limit = max(1, min(50, limit))
-    uid = str(interaction.user.id)
-
-    conn = await get_db()
-    cur = await conn.execute(
-        "SELECT local_date, content, is_private FROM journals WHERE user_id=? AND content LIKE ? ORDER BY datetime(created_at) DESC LIMIT ?",
-        (uid, f"%{q}%", limit)
-    )
-    rows = await cur.fetchall(); await cur.close(); await conn.close()
+    uid = interaction.user.id
+
+    # every word as a quoted prefix term, so FTS operators in the query are plain text
+    match = " ".join('"' + word.replace('"', '""') + '"*' for word in q.split())
+
+    async with acquire_reader() as conn:
+        rows = await conn.execute_fetchall(
+            """
+            SELECT j.local_date, snippet(journals_fts, 0, '**', '**', '…', 24), j.is_private
+            FROM journals_fts JOIN journals j ON j.id = journals_fts.rowid
+            WHERE journals_fts MATCH ? AND j.user_id=?
+            ORDER BY j.created_at DESC LIMIT ?
+            """,
+            (match, uid, limit)
+        )
 
     if not rows:
         await interaction.response.send_message("No matches.", ephemeral=True); return
 
-    def snippet(t: str, q: str, width: int = 140) -> str:
-        t_low, q_low = t.lower(), q.lower()
-        i = t_low.find(q_low)
-        if i == -1:
-            return (t[:width] + "…") if len(t) > width else t
-        start = max(0, i - width // 3)
-        end = min(len(t), i + len(q) + width // 3)
-        s = t[start:end]
-        if start > 0: s = "…" + s
-        if end < len(t): s = s + "…"
-        return s
-
     lines = []
-    for (d, c, priv) in rows:
+    for (d, snip, priv) in rows:
         lock = " 🔒" if priv else ""
-        lines.append(f"**{d}**{lock} — {snippet(c, q)}")
+        lines.append(f"**{d}**{lock} — {snip}")
     out = "\n".join(lines)
     await interaction.response.send_message(out[:2000], ephemeral=True)
 
+EXPORT_SEPARATOR: Final = "\n\n" + "-" * 60 + "\n"
+
 @bot.tree.command(name="exportdiary", description="Export your journal entries as a .txt file")
 @app_commands.describe(scope="Choose last30 or all")
 @app_commands.choices(
@@ -542,23 +1000,23 @@ async def finddiary(interaction: discord.Interaction, query: str, limit: int = 1
 )
 async def exportdiary(interaction: discord.Interaction, scope: app_commands.Choice[str] = None):
     scope_val = (scope.value if scope else "last30").lower()
-    uid = str(interaction.user.id)
-    conn = await get_db()
-    base = "SELECT local_date, content, is_private FROM journals WHERE user_id=? ORDER BY datetime(created_at) DESC"
+    uid = interaction.user.id
+    base = "SELECT local_date, content, is_private FROM journals WHERE user_id=? ORDER BY created_at DESC"
     sql = base + (" LIMIT 30" if scope_val == "last30" else "")
-    cur = await conn.execute(sql, (uid,))
-    rows = await cur.fetchall(); await cur.close(); await conn.close()
+    async with acquire_reader() as conn:
+        rows = await conn.execute_fetchall(sql, (uid,))
 
     if not rows:
         await interaction.response.send_message("No entries to export.", ephemeral=True); return
 
-    out_lines = []
+    # encode entry by entry straight into the file buffer; no joined or intermediate copy
+    b = io.BytesIO()
+    text = io.TextIOWrapper(b, encoding="utf-8", newline="", write_through=True)
     for (d, c, priv) in rows:
         lock = " [PRIVATE]" if priv else ""
-        out_lines.append(f"{d}{lock}\n{c}\n\n" + ("-"*60) + "\n")
-    data = "".join(out_lines).encode("utf-8")
-
-    b = io.BytesIO(data); b.seek(0)
+        text.write(f"{d}{lock}\n{c}{EXPORT_SEPARATOR}")
+    text.detach()  # hand b back without the wrapper closing it
+    b.seek(0)
     filename = f"journal_{interaction.user.id}_{scope_val}.txt"
     await interaction.response.send_message(
         content="Your export is ready.",
@@ -566,44 +1024,38 @@ async def exportdiary(interaction: discord.Interaction, scope: app_commands.Choi
         ephemeral=True
     )
 
+async def post_task(interaction: discord.Interaction, content: str) -> discord.Message:
+    """Defer the interaction and post the public task message in parallel; both are Discord round-trips."""
+    _, task_msg = await asyncio.gather(
+        interaction.response.defer(ephemeral=True),
+        interaction.channel.send(content),
+    )
+    return task_msg
+
 @bot.tree.command(name="addtask", description="Add a task for today")
 async def addtask(interaction: discord.Interaction, text: str):
-    await interaction.response.defer(ephemeral=True)
-    task_msg = await interaction.channel.send(f"**Task for {interaction.user.display_name} ({today_iso()})**\n• {text}")
-    conn = await get_db()
-    await conn.execute("""
-        INSERT INTO tasks(user_id, task_date, task_text, done, message_id, channel_id, created_at,
-                          last_threat_at, due_type, due_at, threat_count, closed, completed_at)
-        VALUES (?, ?, ?, 0, ?, ?, ?, NULL, NULL, NULL, 0, 0, NULL)
-    """, (
-        str(interaction.user.id), today_iso(), text,
-        str(task_msg.id), str(task_msg.channel.id), now_utc().isoformat()
-    ))
-    await conn.commit(); await conn.close()
-    await interaction.followup.send("Noted.", ephemeral=True)
+    task_msg = await post_task(
+        interaction, f"**Task for {interaction.user.display_name} ({today_iso()})**\n• {discord.utils.escape_markdown(text)}"
+    )
+    # the task message is already up; the acknowledgement needn't wait on the commit
+    await asyncio.gather(
+        insert_task(interaction.user.id, text, task_msg),
+        interaction.followup.send("Noted.", ephemeral=True),
+    )
 
 @bot.tree.command(name="taskby", description="Task due within N days (nudges begin after that window)")
 async def taskby(interaction: discord.Interaction, days: int, text: str):
     if days <= 0 or days > 365:
         await interaction.response.send_message("Days must be 1–365.", ephemeral=True); return
-    await interaction.response.defer(ephemeral=True)
-    task_msg = await interaction.channel.send(
-        f"**Task for {interaction.user.display_name}** — due within {days} day(s)\n• {text}"
+    task_msg = await post_task(
+        interaction, f"**Task for {interaction.user.display_name}** — due within {days} day(s)\n• {discord.utils.escape_markdown(text)}"
+    )
+    due_date_local = (dt.datetime.now(TZINFO) + dt.timedelta(days=days)).date()
+    due_at_utc = end_of_day_utc(due_date_local)
+    await asyncio.gather(
+        insert_task(interaction.user.id, text, task_msg, "by_days", due_at_utc),
+        interaction.followup.send("Registered.", ephemeral=True),
     )
-    tz = ZoneInfo(TZ)
-    due_date_local = (dt.datetime.now(tz) + dt.timedelta(days=days)).date()
-    due_at_utc = end_of_day_utc(due_date_local, TZ)
-    conn = await get_db()
-    await conn.execute("""
-        INSERT INTO tasks(user_id, task_date, task_text, done, message_id, channel_id, created_at,
-                          last_threat_at, due_type, due_at, threat_count, closed, completed_at)
-        VALUES (?, ?, ?, 0, ?, ?, ?, NULL, 'by_days', ?, 0, 0, NULL)
-    """, (
-        str(interaction.user.id), today_iso(), text,
-        str(task_msg.id), str(task_msg.channel.id), now_utc().isoformat(), due_at_utc.isoformat()
-    ))
-    await conn.commit(); await conn.close()
-    await interaction.followup.send("Registered.", ephemeral=True)
 
 @bot.tree.command(name="taskon", description="Task due by the end of a specific date (YYYY-MM-DD)")
 async def taskon(interaction: discord.Interaction, date: str, text: str):
@@ -611,39 +1063,31 @@ async def taskon(interaction: discord.Interaction, date: str, text: str):
         due_date = dt.date.fromisoformat(date)
     except Exception:
         await interaction.response.send_message("Use YYYY-MM-DD.", ephemeral=True); return
-    await interaction.response.defer(ephemeral=True)
-    task_msg = await interaction.channel.send(
-        f"**Task for {interaction.user.display_name}** — due by end of {date}\n• {text}"
+    task_msg = await post_task(
+        interaction, f"**Task for {interaction.user.display_name}** — due by end of {date}\n• {discord.utils.escape_markdown(text)}"
+    )
+    due_at_utc = end_of_day_utc(due_date)
+    await asyncio.gather(
+        insert_task(interaction.user.id, text, task_msg, "on_date", due_at_utc),
+        interaction.followup.send("Understood.", ephemeral=True),
     )
-    due_at_utc = end_of_day_utc(due_date, TZ)
-    conn = await get_db()
-    await conn.execute("""
-        INSERT INTO tasks(user_id, task_date, task_text, done, message_id, channel_id, created_at,
-                          last_threat_at, due_type, due_at, threat_count, closed, completed_at)
-        VALUES (?, ?, ?, 0, ?, ?, ?, NULL, 'on_date', ?, 0, 0, NULL)
-    """, (
-        str(interaction.user.id), today_iso(), text,
-        str(task_msg.id), str(task_msg.channel.id), now_utc().isoformat(), due_at_utc.isoformat()
-    ))
-    await conn.commit(); await conn.close()
-    await interaction.followup.send("Understood.", ephemeral=True)
 
 @bot.tree.command(name="remindme", description="DM me a reminder after N hours")
 async def remindme(interaction: discord.Interaction, hours: int, text: str):
     if hours <= 0 or hours > 24*14:
         await interaction.response.send_message("Hours must be 1–336.", ephemeral=True); return
     await interaction.response.defer(ephemeral=True)
-    remind_at = now_utc() + dt.timedelta(hours=hours)
-    conn = await get_db()
-    await conn.execute("""
-        INSERT INTO reminders(user_id, channel_id, text, remind_at, created_at, sent)
-        VALUES (?, ?, ?, ?, ?, 0)
-    """, (
-        str(interaction.user.id), str(interaction.channel_id), text, remind_at.isoformat(), now_utc().isoformat()
-    ))
-    await conn.commit(); await conn.close()
+    now = epoch(now_utc())
+    async with DB_LOCK:
+        await DB.execute(SQL_INSERT_REMINDER, (
+            interaction.user.id, interaction.channel_id, text, now + hours * 3600, now
+        ))
+        await DB.commit()
+    _reminder_wakeup.set()
     await interaction.followup.send(f"Noted. I’ll whisper in {hours} hour(s).", ephemeral=True)
 
+TASK_MARKS: Final = ("⬜️", "✅")  # indexed by tasks.done
+
 @bot.tree.command(name="mytasks", description="View your tasks")
 @app_commands.describe(scope="Which tasks to show: today, open, or all")
 @app_commands.choices(
@@ -655,37 +1099,34 @@ async def remindme(interaction: discord.Interaction, hours: int, text: str):
 )
 async def mytasks(interaction: discord.Interaction, scope: app_commands.Choice[str] = None):
     scope_val = (scope.value if scope else "today").lower()
-    uid = str(interaction.user.id)
-    conn = await get_db()
+    uid = interaction.user.id
 
-    if scope_val == "today":
-        cur = await conn.execute(
-            "SELECT task_text, done, task_date FROM tasks WHERE user_id=? AND task_date=? ORDER BY id ASC",
-            (uid, today_iso())
-        )
-    elif scope_val == "open":
-        cur = await conn.execute(
-            "SELECT task_text, done, task_date FROM tasks WHERE user_id=? AND done=0 ORDER BY created_at ASC",
-            (uid,)
-        )
-    else:  # all
-        cur = await conn.execute(
-            "SELECT task_text, done, task_date FROM tasks WHERE user_id=? ORDER BY created_at DESC",
-            (uid,)
-        )
-    rows = await cur.fetchall()
-    await cur.close(); await conn.close()
+    async with acquire_reader() as conn:
+        rows = await conn.execute_fetchall(MYTASKS_SQL.get(scope_val, MYTASKS_SQL["all"]),
+                                           {"uid": uid, "day": today_iso(), "cap": MYTASKS_ROW_CAP})
 
     if not rows:
         await interaction.response.send_message("No tasks match that view.", ephemeral=True)
         return
 
-    def line(i, text, done, d):
-        return f"{'✅' if done else '⬜️'} {i}) [{d}] {text}" if scope_val != "today" else f"{'✅' if done else '⬜️'} {i}) {text}"
-
-    out = "\n".join(line(i, t, d, date) for i, (t, d, date) in enumerate(rows, 1))
-    title = "**Your tasks**" if scope_val != "today" else "**Your tasks for today**"
-    await interaction.response.send_message(f"{title}\n{out}", ephemeral=True)
+    if scope_val == "today":
+        title = "**Your tasks for today**"
+        lines = (f"{TASK_MARKS[done]} {i}) {text}" for i, (text, done, _, _) in enumerate(rows, 1))
+    else:
+        title = "**Your tasks**"
+        lines = (f"{TASK_MARKS[done]} {i}) [{d}] {text}" for i, (text, done, d, _) in enumerate(rows, 1))
+
+    # stay under Discord's 2000-char message limit; a longer send is rejected outright
+    total = rows[0][3]
+    out, size = [title], len(title)
+    for line in lines:
+        size += len(line) + 1
+        if size > 1950:
+            break
+        out.append(line)
+    if total > len(out) - 1:
+        out.append(f"… and {total - (len(out) - 1)} more")
+    await interaction.response.send_message("\n".join(out), ephemeral=True)
 
 @bot.tree.command(name="cleartasks", description="Clear your tasks (today | open | all)")
 @app_commands.describe(scope="Which tasks to clear: today, open, or all")
@@ -698,34 +1139,24 @@ async def mytasks(interaction: discord.Interaction, scope: app_commands.Choice[s
 )
 async def cleartasks(interaction: discord.Interaction, scope: app_commands.Choice[str] = None):
     scope_val = (scope.value if scope else "today").lower()
-    uid = str(interaction.user.id)
-    conn = await get_db()
-
-    # Count first
-    if scope_val == "today":
-        cur = await conn.execute("SELECT COUNT(*) FROM tasks WHERE user_id=? AND task_date=?", (uid, today_iso()))
-    elif scope_val == "open":
-        cur = await conn.execute("SELECT COUNT(*) FROM tasks WHERE user_id=? AND done=0", (uid,))
-    else:
-        cur = await conn.execute("SELECT COUNT(*) FROM tasks WHERE user_id=?", (uid,))
-    (count_to_delete,) = await cur.fetchone(); await cur.close()
-
-    # Delete + tidy celebrations
-    if scope_val == "today":
-        await conn.execute("DELETE FROM tasks WHERE user_id=? AND task_date=?", (uid, today_iso()))
-        await conn.execute("DELETE FROM celebrations WHERE user_id=? AND task_date=?", (uid, today_iso()))
-    elif scope_val == "open":
-        await conn.execute("DELETE FROM tasks WHERE user_id=? AND done=0", (uid,))
-    else:
-        await conn.execute("DELETE FROM tasks WHERE user_id=?", (uid,))
-        await conn.execute("DELETE FROM celebrations WHERE user_id=?", (uid,))
-    await conn.commit(); await conn.close()
+    uid = interaction.user.id
+
+    key = scope_val if scope_val in CLEAR_TASKS_SQL else "all"
+    params = {"uid": uid, "day": today_iso()}
+    async with DB_LOCK:
+        deleted = await DB.execute_fetchall(CLEAR_TASKS_SQL[key], params)
+        if CLEAR_CELEBRATIONS_SQL[key]:
+            await DB.execute(CLEAR_CELEBRATIONS_SQL[key], params)
+        await DB.commit()
+        # a deleted task's message no longer counts as an open task
+        _open_task_messages.difference_update(message_id for (message_id,) in deleted)
+    count_to_delete = len(deleted)
 
     await interaction.response.send_message(f"Cleared **{count_to_delete}** task(s) ({scope_val}).", ephemeral=True)
 
 @bot.tree.command(name="peptalk", description="Post a random pep talk MP3")
 async def peptalk(interaction: discord.Interaction):
-    mp3 = pick_peptalk_mp3()
+    mp3 = await asyncio.to_thread(pick_peptalk_mp3)
     if not mp3:
         await interaction.response.send_message(
             f"No pep talks found. Expected in: {PEPTALKS_DIR}, /app/peptalks, ./peptalks, or /peptalks",
@@ -741,43 +1172,35 @@ async def peptalk(interaction: discord.Interaction):
 # -------------------- reactions --------------------
 @bot.event
 async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
-    if str(payload.emoji) != "✅":
+    if payload.emoji.name != "✅":
         return
-    conn = await get_db()
-    cur = await conn.execute("SELECT user_id, done FROM tasks WHERE message_id=?", (str(payload.message_id),))
-    row = await cur.fetchone(); await cur.close()
-    if not row:
-        await conn.close(); return
-    user_id, done = row
-    if str(payload.user_id) != user_id:
-        await conn.close(); return
-    if not done:
-        await conn.execute(
-            "UPDATE tasks SET done=1, completed_at=? WHERE message_id=?",
-            (now_utc().isoformat(), str(payload.message_id))
-        )
-        await conn.commit()
-    await conn.close()
-
-    channel = bot.get_channel(payload.channel_id) or await bot.fetch_channel(payload.channel_id)
-    user = await bot.fetch_user(payload.user_id)
-    await channel.send(f"{user.mention} {pick(LINES['task_tick'])}")
-
-    # celebration check: count tasks completed today (any task type)
-    conn2 = await get_db()
-    cur2 = await conn2.execute(
-        "SELECT COUNT(*) FROM tasks WHERE user_id=? AND done=1 AND DATE(completed_at)=?",
-        (str(payload.user_id), today_iso())
-    )
-    (done_count,) = await cur2.fetchone(); await cur2.close()
-    cur3 = await conn2.execute(
-        "SELECT sent FROM celebrations WHERE user_id=? AND task_date=?",
-        (str(payload.user_id), today_iso())
-    )
-    row3 = await cur3.fetchone(); await cur3.close()
-    if done_count >= CELEBRATE_THRESHOLD and (not row3 or row3[0] == 0):
-        img = pick_celebration_image()
-        say = pick(LINES["celebrate"])
+    if bot.user is not None and payload.user_id == bot.user.id:
+        return
+    if payload.message_id not in _open_task_messages:
+        return
+    uid, day = payload.user_id, today_iso()
+    # Mark done, count the day and claim the celebration in one transaction;
+    # Discord only hears about it after the commit.
+    celebrate = False
+    async with DB_LOCK:
+        marked = await fetch_one(DB, SQL_MARK_DONE, (epoch(now_utc()), payload.message_id, uid))
+        if marked:
+            start, end = local_day_bounds(local_date_today())
+            celebrate = await fetch_one(DB, SQL_CLAIM_CELEBRATION, {
+                "uid": uid, "day": day, "start": start, "end": end, "threshold": CELEBRATE_THRESHOLD
+            }) is not None
+        await DB.commit()
+    if not marked:
+        return  # not the owner's reaction, or already done
+    _open_task_messages.discard(payload.message_id)
+
+    channel = await resolve_channel(payload.channel_id)
+    user = await resolve_user(payload.user_id)
+    await channel.send(user.mention + " " + pick_line("task_tick"))
+
+    if celebrate:
+        img = await asyncio.to_thread(pick_celebration_image)
+        say = pick_line("celebrate")
         try:
             if img:
                 await channel.send(content=f"{user.mention} {say}", file=discord.File(img))
@@ -785,130 +1208,198 @@ async def on_raw_reaction_add(payload: discord.RawReactionActionEvent):
                 await channel.send(f"{user.mention} {say}")
         except Exception:
             pass
-        await conn2.execute(
-            """INSERT INTO celebrations(user_id, task_date, sent) VALUES(?, ?, 1)
-               ON CONFLICT(user_id, task_date) DO UPDATE SET sent=1""",
-            (str(payload.user_id), today_iso())
-        )
-        await conn2.commit()
-    await conn2.close()
 
 # -------------------- jobs --------------------
+DAILY_PROMPT_SUFFIX: Final = "\nUse `/addtask` to register a task."
+
 async def daily_prompt():
     if not ANNOUNCE_CHANNEL_ID: return
-    channel = bot.get_channel(ANNOUNCE_CHANNEL_ID) or await bot.fetch_channel(ANNOUNCE_CHANNEL_ID)
-    await channel.send(f"{pick(LINES['daily_prompt'])}\nUse `/addtask` to register a task.")
+    channel = await resolve_channel(ANNOUNCE_CHANNEL_ID)
+    await channel.send(pick_line("daily_prompt") + DAILY_PROMPT_SUFFIX)
 
 async def journal_daily_prompt():
     if not JOURNAL_CHANNEL_ID:
         return
-    parent = bot.get_channel(JOURNAL_CHANNEL_ID) or await bot.fetch_channel(JOURNAL_CHANNEL_ID)
-    prompt_texts = [
-        "Three minutes. One page. Make it count.",
-        "Write with restraint; reveal with honesty.",
-        "Record what mattered—not everything that happened.",
-        "A day unexamined repeats itself.",
-        "Clarity prefers ink.",
-        "Give your memory a witness.",
-        "Note one thing you’d repeat and one you wouldn’t.",
-        "You can’t improve what you won’t observe.",
-        "Civilise the day with language.",
-        "Say less, mean more."
-    ]
+    parent = await resolve_channel(JOURNAL_CHANNEL_ID)
     today = dt.date.today().isoformat()
-    line = random.choice(prompt_texts)
+    line = pick_line("journal_prompt")
     await parent.send(f"**Journal prompt — {today}**\n{line}", view=JournalPromptView())
 
-async def threat_scan():
-    conn = await get_db()
-    cur = await conn.execute("""
-        SELECT id, user_id, message_id, channel_id, created_at, last_threat_at,
-               due_type, due_at, threat_count, closed
-        FROM tasks
-        WHERE done=0
-    """)
-    rows = await cur.fetchall(); await cur.close()
-    now = now_utc()
-    for (tid, user_id, message_id, channel_id, created_at, last_threat_at,
-         due_type, due_at, threat_count, closed) in rows:
-        if closed: continue
-        created_dt = parse_iso(created_at); last_dt = parse_iso(last_threat_at); due_dt = parse_iso(due_at)
-        if not created_dt: continue
-        if (threat_count or 0) >= MAX_THREATS_PER_TASK: continue
-        if due_dt is not None:
-            ready = now >= due_dt
-        else:
-            age_min = (now - created_dt).total_seconds() / 60
-            ready = age_min >= THREAT_GRACE_MINUTES
-        if not ready: continue
-        cooldown_ok = (last_dt is None) or ((now - last_dt).total_seconds() / 60 >= THREAT_COOLDOWN_MINUTES)
-        if not cooldown_ok: continue
+def batch_lines(lines: list[str], limit: int = 1900) -> list[list[str]]:
+    """Group lines into as few messages as fit under Discord's 2000-char cap."""
+    batches, cur, size = [], [], 0
+    for line in lines:
+        if cur and size + len(line) + 1 > limit:
+            batches.append(cur)
+            cur, size = [], 0
+        cur.append(line)
+        size += len(line) + 1
+    if cur:
+        batches.append(cur)
+    return batches
+
+def chunk_lines(lines: list[str], limit: int = 1900) -> list[str]:
+    """Join lines into as few messages as fit under Discord's 2000-char cap."""
+    return ["\n".join(batch) for batch in batch_lines(lines, limit)]
+
+# A task whose message or channel is gone (or off-limits) is closed; any other
+# failure leaves it due so the next pass tries again.
+THREAT_GONE = (discord.NotFound, discord.Forbidden)
+# A reply carries a message_reference, and Discord rejects one to a deleted message
+# with a 400 (50035 Invalid Form Body) or 404 (10008 Unknown Message), not a NotFound.
+REPLY_GONE_CODES = frozenset({10008, 50035})
+
+async def _threat_channel(channel_id: int, tasks: list[tuple[int, int, int]], live: set[int],
+                          sem: asyncio.Semaphore, results: list[tuple[int, bool]]):
+    """
+    Nudge every (task id, owner id, message id) waiting in one channel, appending
+    (task id, True if nudged / False to close it) to results as each send settles,
+    so an error later on can't lose them; tasks left out stay due.
+    Messages in live are known to still exist, and when there are several they share
+    one post that links back to each. The rest get a reply on their own message,
+    which Discord rejects (see REPLY_GONE_CODES) once it has been deleted.
+    """
+    async with sem:
         try:
-            channel = bot.get_channel(int(channel_id)) or await bot.fetch_channel(int(channel_id))
-            msg = await channel.fetch_message(int(message_id))
-            await msg.reply(pick(LINES["threat"]))
-            await conn.execute(
-                "UPDATE tasks SET last_threat_at=?, threat_count=COALESCE(threat_count,0)+1 WHERE id=?",
-                (now.isoformat(), tid)
-            ); await conn.commit()
+            channel = await resolve_channel(channel_id)
+        except THREAT_GONE:
+            results.extend((tid, False) for tid, _, _ in tasks)
+            return
         except Exception:
-            await conn.execute("UPDATE tasks SET closed=1, last_threat_at=? WHERE id=?", (now.isoformat(), tid))
-            await conn.commit()
-    await conn.close()
-
-async def reminder_scan():
-    conn = await get_db()
-    cur = await conn.execute("SELECT id, user_id, channel_id, text, remind_at FROM reminders WHERE sent=0")
-    rows = await cur.fetchall(); await cur.close()
-    now = now_utc()
-    for (rid, user_id, channel_id, text, remind_at) in rows:
-        due = parse_iso(remind_at)
-        if not due or due > now: continue
-        try:
-            user = await bot.fetch_user(int(user_id))
+            return
+        linked = [t for t in tasks if t[2] in live]
+        if len(linked) < 2:
+            linked = []
+        for tid, _, message_id in tasks:
+            if linked and message_id in live:
+                continue
             try:
-                await user.send(f"Reminder: {text}")
+                await channel.get_partial_message(message_id).reply(pick_line("threat"))
+                results.append((tid, True))
+            except THREAT_GONE:
+                results.append((tid, False))
+            except discord.HTTPException as e:
+                if e.code in REPLY_GONE_CODES:
+                    results.append((tid, False))
             except Exception:
+                pass
+        if linked:
+            # same URL PartialMessage.jump_url builds, without an object per task
+            jump = f"https://discord.com/channels/{getattr(channel.guild, 'id', '@me')}/{channel.id}/"
+            lines = [f"<@{user_id}> {pick_line('threat')} {jump}{message_id}" for _, user_id, message_id in linked]
+            done = 0
+            for batch in batch_lines(lines):
+                sent = linked[done:done + len(batch)]
+                done += len(batch)
                 try:
-                    channel = bot.get_channel(int(channel_id)) or await bot.fetch_channel(int(channel_id))
-                    await channel.send(f"<@{user_id}> Reminder: {text}")
-                except Exception: pass
-        finally:
-            await conn.execute("UPDATE reminders SET sent=1 WHERE id=?", (rid,))
-            await conn.commit()
-    await conn.close()
+                    await channel.send("\n".join(batch))
+                    results.extend((tid, True) for tid, _, _ in sent)
+                except THREAT_GONE:
+                    results.extend((tid, False) for tid, _, _ in sent)
+                except Exception:
+                    pass
+
+async def threat_scan():
+    # Readiness (due date or grace window), cooldown and the threat cap are decided by SQLite,
+    # so only tasks that are actually due for a nudge come back.
+    now = epoch(now_utc())
+    async with acquire_reader() as conn:
+        # most scans find nothing open at all; answer that from the index alone
+        if not await conn.execute_fetchall(SQL_ANY_OPEN_TASK):
+            return
+        rows = await conn.execute_fetchall(
+            SQL_THREAT_CANDIDATES, (MAX_THREATS_PER_TASK, now, now - THREAT_GRACE_MINUTES * 60,
+                                    now - THREAT_COOLDOWN_MINUTES * 60)
+        )
+    by_channel: dict[int, list[tuple[int, int, int]]] = defaultdict(list)
+    for (tid, user_id, message_id, channel_id) in rows:
+        by_channel[channel_id].append((tid, user_id, message_id))
+    if not by_channel:
+        return
+    # discord.py drops a message from its cache when it is deleted, so a cached one is still there
+    live = {m.id for m in bot.cached_messages}
+    sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+    results: list[tuple[int, bool]] = []
+    outcomes = await asyncio.gather(
+        *(_threat_channel(cid, tasks, live, sem, results) for cid, tasks in by_channel.items()),
+        return_exceptions=True
+    )
+    for e in outcomes:
+        if isinstance(e, Exception):
+            print("[threat_scan] channel failed:", repr(e))
+    # record every nudge that did go out, even if another channel blew up
+    threatened = [(now, tid) for tid, ok in results if ok]
+    closures = [(now, tid) for tid, ok in results if not ok]
+    # one transaction for the whole pass
+    async with DB_LOCK:
+        if threatened:
+            await DB.executemany(SQL_THREAT_SENT, threatened)
+        if closures:
+            await DB.executemany(SQL_THREAT_CLOSE, closures)
+        await DB.commit()
+
+async def _remind_one(user_id: int, channel_id: int, text: str, sem: asyncio.Semaphore):
+    async with sem:
+        try:
+            user = await resolve_user(user_id)
+            await user.send(f"Reminder: {text}")
+        except Exception:
+            try:
+                channel = await resolve_channel(channel_id)
+                await channel.send(f"<@{user_id}> Reminder: {text}")
+            except Exception: pass
+
+async def reminder_scan():
+    now = epoch(now_utc())
+    async with acquire_reader() as conn:
+        rows = await conn.execute_fetchall(
+            "SELECT id, user_id, channel_id, text FROM reminders WHERE sent=0 AND remind_at <= ?", (now,)
+        )
+    if not rows:
+        return
+    sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+    await asyncio.gather(*(_remind_one(user_id, channel_id, text, sem) for _, user_id, channel_id, text in rows))
+    # every reminder is spent after one attempt; mark the whole pass in one transaction
+    async with DB_LOCK:
+        await DB.executemany("UPDATE reminders SET sent=1 WHERE id=?", [(rid,) for rid, *_ in rows])
+        await DB.commit()
 
 # -------------------- streak logic --------------------
-def local_date_today(tz_str: str) -> dt.date:
-    tz = ZoneInfo(tz_str)
-    return dt.datetime.now(tz).date()
+def local_date_today() -> dt.date:
+    return dt.datetime.now(TZINFO).date()
 
-def local_date_yesterday(tz_str: str) -> dt.date:
-    return local_date_today(tz_str) - dt.timedelta(days=1)
+def local_date_yesterday() -> dt.date:
+    return local_date_today() - dt.timedelta(days=1)
 
-async def get_all_user_ids(conn) -> list[str]:
-    cur = await conn.execute("SELECT DISTINCT user_id FROM tasks")
-    rows = await cur.fetchall(); await cur.close()
+async def get_all_user_ids(conn) -> list[int]:
+    rows = await conn.execute_fetchall("SELECT DISTINCT user_id FROM tasks")
     return [r[0] for r in rows]
 
-async def completed_on_date(conn, user_id: str, day: dt.date) -> bool:
-    cur = await conn.execute(
-        "SELECT 1 FROM tasks WHERE user_id=? AND done=1 AND DATE(completed_at)=? LIMIT 1",
-        (user_id, day.isoformat())
+STREAK_MAX_DAYS = 365
+
+async def completion_days(conn, end_day: dt.date) -> dict[int, set[dt.date]]:
+    """
+    Local dates with at least one completion, per user, over the STREAK_MAX_DAYS
+    ending at end_day. One query for everyone instead of a probe per user per day.
+    """
+    start, _ = local_day_bounds(end_day - dt.timedelta(days=STREAK_MAX_DAYS - 1))
+    _, end = local_day_bounds(end_day)
+    rows = await conn.execute_fetchall(
+        "SELECT user_id, completed_at FROM tasks WHERE done=1 AND completed_at >= ? AND completed_at < ?",
+        (start, end)
     )
-    row = await cur.fetchone(); await cur.close()
-    return bool(row)
+    days: dict[int, set[dt.date]] = defaultdict(set)
+    for user_id, completed_at in rows:
+        days[user_id].add(dt.datetime.fromtimestamp(completed_at, TZINFO).date())
+    return days
 
-async def compute_streak(conn, user_id: str, end_day: dt.date) -> int:
+def compute_streak(days: set[dt.date], end_day: dt.date) -> int:
     """
     Count consecutive days (backwards from end_day inclusive) with >=1 completion.
     """
     streak = 0
     day = end_day
-    for _ in range(365):
-        ok = await completed_on_date(conn, user_id, day)
-        if not ok:
-            break
+    while streak < STREAK_MAX_DAYS and day in days:
         streak += 1
         day = day - dt.timedelta(days=1)
     return streak
@@ -921,58 +1412,87 @@ async def streak_digest_all():
       - If streak is a multiple of 7, post a random video (DM + optional announce).
       - Record award in streak_awards to avoid duplicate sends for the same day.
     """
-    local_yday = local_date_yesterday(TZ)
-    conn = await get_db()
-    users = await get_all_user_ids(conn)
-    for user_id in users:
-        streak = await compute_streak(conn, user_id, local_yday)
+    local_yday = local_date_yesterday()
+    award_date = local_yday.isoformat()
+    async with acquire_reader() as conn:
+        users = await get_all_user_ids(conn)
+        done_days = await completion_days(conn, local_yday)
+        awarded = {r[0] for r in await conn.execute_fetchall(
+            "SELECT user_id FROM streak_awards WHERE award_date=?", (award_date,)
+        )}
+    sem = asyncio.Semaphore(SCAN_CONCURRENCY)
+    streaks = {user_id: compute_streak(done_days.get(user_id, set()), local_yday) for user_id in users}
+    awards = await asyncio.gather(*(
+        _digest_one(user_id, streak, user_id not in awarded, sem) for user_id, streak in streaks.items()
+    ))
+    awards = [(user_id, award_date, streaks[user_id]) for user_id in awards if user_id is not None]
+    if awards:
+        async with DB_LOCK:
+            await DB.executemany(
+                "INSERT OR IGNORE INTO streak_awards(user_id, award_date, streak_len) VALUES(?, ?, ?)", awards
+            )
+            await DB.commit()
+
+async def _digest_one(user_id: int, streak: int, may_award: bool, sem: asyncio.Semaphore) -> int | None:
+    """DM one user their streak; returns user_id when a 7-day award went out."""
+    async with sem:
         # Send DM
         try:
-            user = await bot.fetch_user(int(user_id))
+            user = await resolve_user(user_id)
             if streak > 0:
-                line = pick(LINES["streak_keep"])
+                line = pick_line("streak_keep")
                 await user.send(f"Streak: **{streak}** day(s). {line}")
             else:
-                line = pick(LINES["streak_reset"])
+                line = pick_line("streak_reset")
                 await user.send(f"Streak: **0**. {line}")
         except Exception:
             pass
 
         # Check 7-day multiple reward, avoid duplicate for this date
-        if streak > 0 and streak % 7 == 0:
-            cur = await conn.execute(
-                "SELECT 1 FROM streak_awards WHERE user_id=? AND award_date=?",
-                (user_id, local_yday.isoformat())
-            )
-            already = await cur.fetchone(); await cur.close()
-            if not already:
-                vid = pick_streak_video()
-                try:
-                    user = await bot.fetch_user(int(user_id))
-                    if vid:
-                        await user.send(content=f"Seven in a row. Sustained taste.", file=discord.File(vid))
-                    else:
-                        await user.send("Seven in a row. Sustained taste. (No video found.)")
-                except Exception:
-                    pass
-                # Optionally also announce in a channel
-                if ANNOUNCE_CHANNEL_ID:
-                    try:
-                        channel = bot.get_channel(ANNOUNCE_CHANNEL_ID) or await bot.fetch_channel(ANNOUNCE_CHANNEL_ID)
-                        if vid:
-                            await channel.send(content=f"<@{user_id}> Seven days. Civilised.", file=discord.File(vid))
-                        else:
-                            await channel.send(f"<@{user_id}> Seven days. Civilised. (No video found.)")
-                    except Exception:
-                        pass
-                await conn.execute(
-                    "INSERT INTO streak_awards(user_id, award_date, streak_len) VALUES(?, ?, ?)",
-                    (user_id, local_yday.isoformat(), streak)
-                )
-                await conn.commit()
-    await conn.close()
+        if not (may_award and streak > 0 and streak % 7 == 0):
+            return None
+        vid = await asyncio.to_thread(pick_streak_video)
+        try:
+            user = await resolve_user(user_id)
+            if vid:
+                await user.send(content=f"Seven in a row. Sustained taste.", file=discord.File(vid))
+            else:
+                await user.send("Seven in a row. Sustained taste. (No video found.)")
+        except Exception:
+            pass
+        # Optionally also announce in a channel
+        if ANNOUNCE_CHANNEL_ID:
+            try:
+                channel = await resolve_channel(ANNOUNCE_CHANNEL_ID)
+                if vid:
+                    await channel.send(content=f"<@{user_id}> Seven days. Civilised.", file=discord.File(vid))
+                else:
+                    await channel.send(f"<@{user_id}> Seven days. Civilised. (No video found.)")
+            except Exception:
+                pass
+        return user_id
 
 # -------------------- askmads --------------------
+# Repeated questions ("plan my day") get the recent answer back instead of another
+# model call; keyed on the case/whitespace-folded question, oldest entries evicted first.
+ASK_CACHE_SIZE = 512
+ASK_CACHE_TTL_SECONDS = 3600
+_answer_cache: dict[bytes, tuple[float, str]] = {}
+_openai_sem = asyncio.Semaphore(OPENAI_CONCURRENCY)
+
+# Persona prompt: emulate the cool, dry tone—without claiming to be the real person.
+# Sent first and byte-identical on every call so the provider can reuse the prefix.
+ASK_SYSTEM_PROMPT: Final = (
+    "You are 'MadsMinder', a laconic, sharp-witted productivity consigliere with a cool, dry Danish cadence. "
+    "You speak briefly, precisely, and with understated elegance. "
+    "Offer practical, grounded answers with a calm, slightly ominous charm. "
+    "Avoid explicit impersonation claims; you're an assistant with that vibe. "
+    "Keep replies under 180–220 words unless the user asks for detail."
+)
+
+def _question_key(question: str) -> bytes:
+    return hashlib.blake2b(" ".join(question.lower().split()).encode(), digest_size=16).digest()
+
 @bot.tree.command(name="askmads", description="Ask MadsMinder anything. He’ll answer… in his style.")
 async def askmads(interaction: discord.Interaction, question: str):
     # basic guard
@@ -985,30 +1505,39 @@ async def askmads(interaction: discord.Interaction, question: str):
 
     await interaction.response.defer(thinking=True, ephemeral=False)
 
-    # Persona prompt: emulate the cool, dry tone—without claiming to be the real person.
-    system_instructions = (
-        "You are 'MadsMinder', a laconic, sharp-witted productivity consigliere with a cool, dry Danish cadence. "
-        "You speak briefly, precisely, and with understated elegance. "
-        "Offer practical, grounded answers with a calm, slightly ominous charm. "
-        "Avoid explicit impersonation claims; you're an assistant with that vibe. "
-        "Keep replies under 180–220 words unless the user asks for detail."
-    )
+    key = _question_key(question)
+    hit = _answer_cache.get(key)
+    if hit and time.monotonic() - hit[0] < ASK_CACHE_TTL_SECONDS:
+        await interaction.followup.send(hit[1])
+        return
 
     try:
-        resp = openai_client.responses.create(
-            model="gpt-4o",
-            input=[{"role": "system", "content": system_instructions},
-                   {"role": "user", "content": question}],
-            temperature=0.7,
-        )
+        async with _openai_sem:
+            resp = await openai_client.responses.create(
+                model="gpt-4o",
+                input=[{"role": "system", "content": ASK_SYSTEM_PROMPT},
+                       {"role": "user", "content": question}],
+                temperature=0.7,
+            )
         text = resp.output_text.strip()
+        _answer_cache.pop(key, None)
+        _answer_cache[key] = (time.monotonic(), text)
+        if len(_answer_cache) > ASK_CACHE_SIZE:
+            del _answer_cache[next(iter(_answer_cache))]
     except Exception as e:
         text = f"(MadsMinder pauses.) Something went wrong: `{e}`"
 
     await interaction.followup.send(text)
 
 # -------------------- entrypoint --------------------
+async def main():
+    try:
+        async with bot:
+            await bot.start(TOKEN)
+    finally:
+        await close_db()
+
 if __name__ == "__main__":
     print("[startup] starting discord client…")
-    bot.run(TOKEN, log_handler=None)
+    asyncio.run(main())
 